@@ -4,6 +4,7 @@ import pandas as pd
 from datetime import datetime
 import json
 import os
+import write_queue
 
 # Ensure database directory exists
 if not os.path.exists('database'):
@@ -14,6 +15,9 @@ def init_db():
     conn = sqlite3.connect('database/restaurant.db')
     c = conn.cursor()
     
+    # WAL lets readers, including online backups, run alongside writers
+    c.execute("PRAGMA journal_mode=WAL")
+    
     # Create tables if they don't exist
     c.execute('''
     CREATE TABLE IF NOT EXISTS menu_items (
@@ -93,6 +97,16 @@ def init_db():
     )
     ''')
     
+    # Idempotency keys of writes drained from the write queue
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS applied_writes (
+        idem_key TEXT PRIMARY KEY,
+        row_id INTEGER,
+        error TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
     # Add some initial data if tables are empty
     c.execute("SELECT COUNT(*) FROM menu_items")
     if c.fetchone()[0] == 0:
@@ -135,6 +149,18 @@ def init_session():
         st.session_state.current_order = None
     if 'current_table' not in st.session_state:
         st.session_state.current_table = None
+    if 'queued_writes' not in st.session_state:
+        st.session_state.queued_writes = []
+    if 'failed_writes' not in st.session_state:
+        st.session_state.failed_writes = []
+
+# Queue a write, remember it so the sidebar can report if it fails, and give
+# it a moment to be applied before the page reruns
+def queue_write(statements):
+    key = write_queue.enqueue(statements)
+    st.session_state.queued_writes.append(key)
+    write_queue.wait(key)
+    return key
 
 # Navigation
 def navigation():
@@ -155,6 +181,22 @@ def navigation():
     if st.sidebar.button("📞 Reservations"):
         st.session_state.page = 'reservations'
     
+    # Report changes from this session that failed after they were queued
+    outcomes = write_queue.outcomes(st.session_state.queued_writes)
+    st.session_state.queued_writes = [key for key in st.session_state.queued_writes if key not in outcomes]
+    st.session_state.failed_writes.extend(error for error in outcomes.values() if error)
+    
+    pending_writes = write_queue.pending_count()
+    if pending_writes or st.session_state.failed_writes:
+        st.sidebar.markdown("---")
+    if pending_writes:
+        st.sidebar.info(f"{pending_writes} change(s) waiting to be saved")
+    for error in st.session_state.failed_writes:
+        st.sidebar.error(f"A change could not be saved: {error}")
+    if st.session_state.failed_writes and st.sidebar.button("Dismiss"):
+        st.session_state.failed_writes = []
+        st.experimental_rerun()
+    
     st.sidebar.markdown("---")
     st.sidebar.markdown("© 2025 Casa Delizia")
 
@@ -219,16 +261,12 @@ def tables_page():
                 
                 if row['status'] == "Available":
                     if st.button(f"Occupy Table {row['id']}"):
-                        c = conn.cursor()
-                        c.execute("UPDATE tables SET status = 'Occupied' WHERE id = ?", (row['id'],))
-                        conn.commit()
+                        queue_write([("UPDATE tables SET status = 'Occupied' WHERE id = ?", (row['id'],))])
                         st.success(f"Table {row['id']} is now occupied")
                         st.experimental_rerun()
                 else:
                     if st.button(f"Free Table {row['id']}"):
-                        c = conn.cursor()
-                        c.execute("UPDATE tables SET status = 'Available' WHERE id = ?", (row['id'],))
-                        conn.commit()
+                        queue_write([("UPDATE tables SET status = 'Available' WHERE id = ?", (row['id'],))])
                         st.success(f"Table {row['id']} is now available")
                         st.experimental_rerun()
     
@@ -242,11 +280,7 @@ def tables_page():
         submit = st.form_submit_button("Add Table")
         
         if submit:
-            conn = sqlite3.connect('database/restaurant.db')
-            c = conn.cursor()
-            c.execute("INSERT INTO tables (capacity, status) VALUES (?, 'Available')", (capacity,))
-            conn.commit()
-            conn.close()
+            queue_write([("INSERT INTO tables (capacity, status) VALUES (?, 'Available')", (capacity,))])
             st.success("New table added successfully!")
             st.experimental_rerun()
 
@@ -273,21 +307,32 @@ def orders_page():
             
             submit_order = st.form_submit_button("Create Order")
             if submit_order:
-                c = conn.cursor()
-                c.execute("INSERT INTO orders (table_id, customer_name, status) VALUES (?, ?, 'Pending')", 
-                          (table_id, customer_name))
-                conn.commit()
-                st.session_state.current_order = c.lastrowid
+                # current_order holds the queue key; the order id is known once the write is applied
+                key = queue_write([("INSERT INTO orders (table_id, customer_name, status) VALUES (?, ?, 'Pending')",
+                                    (table_id, customer_name))])
+                st.session_state.current_order = key
                 st.session_state.current_table = table_id
                 st.success(f"Order created for table {table_id}")
                 st.experimental_rerun()
     
+    # Drop the current order if its queued write failed
+    if st.session_state.current_order:
+        try:
+            order_id = write_queue.resolve(st.session_state.current_order)
+        except write_queue.WriteFailed as e:
+            st.error(f"Order for table {st.session_state.current_table} could not be saved: {e}")
+            st.session_state.current_order = None
+            st.session_state.current_table = None
+    
     # Add items to order
     if st.session_state.current_order:
-        order_id = st.session_state.current_order
+        order_key = st.session_state.current_order
         table_id = st.session_state.current_table
         
-        st.subheader(f"Order #{order_id} for Table {table_id}")
+        if order_id:
+            st.subheader(f"Order #{order_id} for Table {table_id}")
+        else:
+            st.subheader(f"New Order for Table {table_id} (saving...)")
         
         menu_items = pd.read_sql("SELECT * FROM menu_items WHERE available = 1", conn)
         with st.form("add_item_form"):
@@ -298,10 +343,8 @@ def orders_page():
             
             submit_item = st.form_submit_button("Add to Order")
             if submit_item:
-                c = conn.cursor()
-                c.execute("INSERT INTO order_items (order_id, menu_item_id, quantity, notes) VALUES (?, ?, ?, ?)",
-                         (order_id, item_id, quantity, notes))
-                conn.commit()
+                queue_write([("INSERT INTO order_items (order_id, menu_item_id, quantity, notes) VALUES (?, ?, ?, ?)",
+                              (write_queue.ref(order_key), item_id, quantity, notes))])
                 st.success("Item added to order!")
                 st.experimental_rerun()
         
@@ -310,27 +353,33 @@ def orders_page():
             SELECT oi.id, mi.name, oi.quantity, mi.price, (oi.quantity * mi.price) as subtotal, oi.notes
             FROM order_items oi
             JOIN menu_items mi ON oi.menu_item_id = mi.id
-            WHERE oi.order_id = {order_id}
-        """, conn)
+            WHERE oi.order_id = ?
+        """, conn, params=(order_id,))
         
-        if not order_items.empty:
-            st.subheader("Current Order Items")
-            st.dataframe(order_items[['name', 'quantity', 'price', 'subtotal', 'notes']])
-            
-            total = order_items['subtotal'].sum()
-            st.markdown(f"**Total: ${total:.2f}**")
+        # Items may still be queued, so keep the order actions available while writes for this order are pending
+        if not order_items.empty or write_queue.has_pending_refs(order_key):
+            if not order_items.empty:
+                st.subheader("Current Order Items")
+                st.dataframe(order_items[['name', 'quantity', 'price', 'subtotal', 'notes']])
+                
+                total = order_items['subtotal'].sum()
+                st.markdown(f"**Total: ${total:.2f}**")
             
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Complete Order"):
-                    c = conn.cursor()
-                    c.execute("UPDATE orders SET status = 'Completed' WHERE id = ?", (order_id,))
-                    conn.commit()
-                    
-                    # Create bill
-                    c.execute("INSERT INTO bills (order_id, amount, status) VALUES (?, ?, 'Unpaid')", 
-                              (order_id, total))
-                    conn.commit()
+                    # Bill amount is summed when the write is applied, after any queued items
+                    queue_write([
+                        ("UPDATE orders SET status = 'Completed' WHERE id = ?", (write_queue.ref(order_key),)),
+                        ("""
+                            INSERT INTO bills (order_id, amount, status)
+                            SELECT ?, SUM(oi.quantity * mi.price), 'Unpaid'
+                            FROM order_items oi
+                            JOIN menu_items mi ON oi.menu_item_id = mi.id
+                            WHERE oi.order_id = ?
+                            HAVING COUNT(oi.id) > 0
+                        """, (write_queue.ref(order_key), write_queue.ref(order_key)), "Order has no items to bill"),
+                    ])
                     
                     st.session_state.current_order = None
                     st.session_state.current_table = None
@@ -338,10 +387,10 @@ def orders_page():
                     st.experimental_rerun()
             with col2:
                 if st.button("Cancel Order"):
-                    c = conn.cursor()
-                    c.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
-                    c.execute("DELETE FROM orders WHERE id = ?", (order_id,))
-                    conn.commit()
+                    queue_write([
+                        ("DELETE FROM order_items WHERE order_id = ?", (write_queue.ref(order_key),)),
+                        ("DELETE FROM orders WHERE id = ?", (write_queue.ref(order_key),)),
+                    ])
                     st.session_state.current_order = None
                     st.session_state.current_table = None
                     st.success("Order cancelled!")
@@ -458,16 +507,12 @@ def billing_page():
                     st.markdown(f"Created: {bill['created_at']}")
                 with col2:
                     if st.button(f"Pay Cash #{bill['id']}"):
-                        c = conn.cursor()
-                        c.execute("UPDATE bills SET status = 'Paid', payment_method = 'Cash' WHERE id = ?", (bill['id'],))
-                        conn.commit()
+                        queue_write([("UPDATE bills SET status = 'Paid', payment_method = 'Cash' WHERE id = ?", (bill['id'],))])
                         st.success(f"Bill #{bill['id']} paid with cash")
                         st.experimental_rerun()
                 with col3:
                     if st.button(f"Pay Card #{bill['id']}"):
-                        c = conn.cursor()
-                        c.execute("UPDATE bills SET status = 'Paid', payment_method = 'Card' WHERE id = ?", (bill['id'],))
-                        conn.commit()
+                        queue_write([("UPDATE bills SET status = 'Paid', payment_method = 'Card' WHERE id = ?", (bill['id'],))])
                         st.success(f"Bill #{bill['id']} paid with card")
                         st.experimental_rerun()
     else:
@@ -663,6 +708,9 @@ def main():
     # Initialize database
     init_db()
     
+    # Start draining queued writes in the background
+    write_queue.start_worker()
+    
     # Initialize session state
     init_session()
     
@@ -0,0 +1,220 @@
+import sqlite3
+import argparse
+import os
+import time
+from datetime import datetime
+
+import write_queue
+
+DB_PATH = 'database/restaurant.db'
+BACKUP_DIR = 'database/backups'
+
+# Number of snapshots kept by rotation
+KEEP = 14
+# Pages copied per backup step; the source is only read-locked during a step
+PAGES_PER_STEP = 1024
+# Seconds to pause between steps so order entry can get at the database
+STEP_SLEEP = 0.01
+
+NAME_PREFIX = 'restaurant-'
+# Snapshots taken by restore() before it overwrites the live database. They
+# are kept out of rotation and point-in-time lookups.
+PRE_RESTORE_PREFIX = 'pre-restore-'
+NAME_FORMAT = '%Y%m%d-%H%M%S-%f'
+
+
+def _backup_name(taken_at, prefix=NAME_PREFIX):
+    return f"{prefix}{taken_at.strftime(NAME_FORMAT)}.db"
+
+
+def _parse_backup_name(name, prefix=NAME_PREFIX):
+    if not (name.startswith(prefix) and name.endswith('.db')):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):-len('.db')], NAME_FORMAT)
+    except ValueError:
+        return None
+
+
+# Snapshots in backup_dir as (taken_at, path), oldest first
+def list_backups(backup_dir=BACKUP_DIR, prefix=NAME_PREFIX):
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        taken_at = _parse_backup_name(name, prefix)
+        if taken_at is not None:
+            backups.append((taken_at, os.path.join(backup_dir, name)))
+    return sorted(backups)
+
+
+def verify(path):
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA integrity_check").fetchall() == [('ok',)]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+# Delete all but the newest `keep` snapshots with the given prefix and
+# return the removed paths
+def rotate(backup_dir=BACKUP_DIR, keep=KEEP, prefix=NAME_PREFIX):
+    backups = list_backups(backup_dir, prefix)
+    removed = []
+    for _, path in backups[:max(len(backups) - keep, 0)]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+# Take a consistent snapshot of the live database with SQLite's online backup
+# API, copying `pages` pages per step. The source connection holds one read
+# transaction for the whole copy; with the database in WAL mode (see init_db
+# in app.py) writers keep committing meanwhile, and the backup does not have
+# to restart because of them. sqlite3 only honours `sleep` when a step hits
+# a busy database, so the pause between steps is taken in the progress
+# callback instead. The snapshot is written under a temporary name
+# and only renamed into place once it passes an integrity check.
+def create_backup(db_path=DB_PATH, backup_dir=BACKUP_DIR, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                  keep=KEEP, progress=None, prefix=NAME_PREFIX):
+    if not os.path.exists(backup_dir):
+        os.makedirs(backup_dir)
+
+    path = os.path.join(backup_dir, _backup_name(datetime.now(), prefix))
+    partial = path + '.partial'
+
+    def step(status, remaining, total):
+        if progress is not None:
+            progress(status, remaining, total)
+        if remaining:
+            time.sleep(sleep)
+
+    src = sqlite3.connect(db_path, isolation_level=None)
+    dst = sqlite3.connect(partial)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, progress=step, sleep=sleep)
+        src.execute("COMMIT")
+        # Snapshots are standalone files; keep them out of WAL mode
+        dst.execute("PRAGMA journal_mode=DELETE")
+    except Exception:
+        dst.close()
+        os.remove(partial)
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    if not verify(partial):
+        os.remove(partial)
+        raise RuntimeError(f"Backup of {db_path} failed the integrity check")
+    os.replace(partial, path)
+
+    if keep is not None:
+        rotate(backup_dir, keep)
+    return path
+
+
+# Restore the newest snapshot taken at or before `at` (the newest overall if
+# `at` is None), or the snapshot file `path`, over the live database. The
+# current state is snapshotted first under PRE_RESTORE_PREFIX so a restore
+# can itself be undone. Writes still in the write queue would be applied on
+# top of the restored data, so restoring is refused while any are pending
+# unless discard_queue is set. Returns the snapshot restored.
+def restore(at=None, db_path=DB_PATH, backup_dir=BACKUP_DIR, path=None, discard_queue=False):
+    if path is None:
+        candidates = [b for b in list_backups(backup_dir) if at is None or b[0] <= at]
+        if not candidates:
+            raise FileNotFoundError(f"No backup in {backup_dir} taken at or before {at}")
+        taken_at, path = candidates[-1]
+
+    if not verify(path):
+        raise RuntimeError(f"Backup {path} failed the integrity check")
+
+    pending = write_queue.pending_count() if os.path.exists(write_queue.QUEUE_PATH) else 0
+    if pending and not discard_queue:
+        raise RuntimeError(f"{pending} queued write(s) have not been applied yet; let the app apply them "
+                           f"first, or discard them with --discard-queue")
+
+    if os.path.exists(db_path):
+        create_backup(db_path, backup_dir, keep=None, prefix=PRE_RESTORE_PREFIX)
+        rotate(backup_dir, KEEP, PRE_RESTORE_PREFIX)
+    if pending:
+        write_queue.discard_pending()
+
+    src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    dst = sqlite3.connect(db_path, timeout=30)
+    try:
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode=WAL")
+    finally:
+        src.close()
+        dst.close()
+    return path
+
+
+# Snapshot names use local time, so --at values with a UTC offset are
+# converted to local time before comparing
+def _parse_at(value):
+    try:
+        at = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}")
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    return at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the Casa Delizia database")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup_cmd = commands.add_parser('backup', help="take a snapshot of the live database")
+    backup_cmd.add_argument('--keep', type=int, default=KEEP)
+    backup_cmd.add_argument('--pages', type=int, default=PAGES_PER_STEP)
+    backup_cmd.add_argument('--sleep', type=float, default=STEP_SLEEP)
+
+    commands.add_parser('list', help="list snapshots, including pre-restore ones")
+
+    verify_cmd = commands.add_parser('verify', help="check snapshot integrity, including pre-restore ones")
+    verify_cmd.add_argument('path', nargs='?')
+
+    restore_cmd = commands.add_parser('restore', help="restore a snapshot over the live database")
+    restore_target = restore_cmd.add_mutually_exclusive_group()
+    restore_target.add_argument('--at', type=_parse_at,
+                                help="restore the newest snapshot at or before this time, e.g. '2025-03-01 18:30'")
+    restore_target.add_argument('--file', help="restore this snapshot file, e.g. a pre-restore snapshot")
+    restore_cmd.add_argument('--discard-queue', action='store_true',
+                             help="drop writes still waiting in the write queue instead of refusing to restore")
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        print(create_backup(args.db, args.dir, args.pages, args.sleep, args.keep))
+    elif args.command == 'list':
+        backups = sorted(list_backups(args.dir) + list_backups(args.dir, PRE_RESTORE_PREFIX))
+        for taken_at, path in backups:
+            print(f"{taken_at:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path):>12}  {path}")
+    elif args.command == 'verify':
+        backups = sorted(list_backups(args.dir) + list_backups(args.dir, PRE_RESTORE_PREFIX))
+        paths = [args.path] if args.path else [path for _, path in backups]
+        failed = [path for path in paths if not verify(path)]
+        for path in paths:
+            print(f"{'FAILED' if path in failed else 'ok':<6}  {path}")
+        if failed:
+            raise SystemExit(1)
+    elif args.command == 'restore':
+        try:
+            print(f"Restored {restore(args.at, args.db, args.dir, args.file, args.discard_queue)}")
+        except (FileNotFoundError, RuntimeError) as e:
+            parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sqlite3
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+import backup
+import write_queue
+
+# Benchmark order-entry latency while backup.create_backup copies a large
+# database. The database is created with app.init_db's schema and padded
+# out to the requested size. A writer thread enters orders the way the
+# Order Processing page does: an order plus a few items, each queued with
+# write_queue.enqueue and applied by the background flush. Both the time
+# until the writes are acknowledged and the time until they are applied to
+# the database are measured, first with the database idle and then while a
+# backup runs.
+
+
+def build_database(workdir, size_mb):
+    # app and app.init_db use database/ relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+        app.init_db()
+    finally:
+        os.chdir(cwd)
+
+    conn = sqlite3.connect(write_queue.DB_PATH)
+    # Historical order history padding the file out to the requested size
+    conn.execute("CREATE TABLE IF NOT EXISTS order_history (id INTEGER PRIMARY KEY, payload BLOB)")
+    rows_per_mb = 1024 * 1024 // 4096
+    for _ in range(size_mb):
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO order_history (payload) SELECT randomblob(4000) FROM n
+        """, (rows_per_mb,))
+        conn.commit()
+    conn.close()
+
+
+def enter_orders(stop, acked, applied, interval):
+    while not stop.is_set():
+        started = time.perf_counter()
+        order_key = write_queue.enqueue([("INSERT INTO orders (table_id, customer_name, status) VALUES (?, ?, 'Pending')",
+                                          (1, "Bench"))])
+        for item_id in (1, 2, 3):
+            key = write_queue.enqueue([("INSERT INTO order_items (order_id, menu_item_id, quantity, notes) VALUES (?, ?, ?, ?)",
+                                        (write_queue.ref(order_key), item_id, 1, ""))])
+        acked.append(time.perf_counter() - started)
+        while write_queue.is_pending(key):
+            time.sleep(0.001)
+        applied.append(time.perf_counter() - started)
+        time.sleep(interval)
+
+
+def summarize(label, latencies):
+    ms = sorted(l * 1000 for l in latencies)
+    q = statistics.quantiles(ms, n=100, method="inclusive")
+    print(f"{label:<24} n={len(ms):<6} p50={q[49]:7.2f}ms  p95={q[94]:7.2f}ms  "
+          f"p99={q[98]:7.2f}ms  max={ms[-1]:7.2f}ms")
+
+
+def run_writer(phase, interval):
+    stop = threading.Event()
+    acked, applied = [], []
+    writer = threading.Thread(target=enter_orders, args=(stop, acked, applied, interval))
+    writer.start()
+    try:
+        phase()
+    finally:
+        stop.set()
+        writer.join()
+    return acked, applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order-entry latency during an online backup")
+    parser.add_argument('--size-mb', type=int, default=2048, help="database size to back up, e.g. 4096 for 4 GB")
+    parser.add_argument('--pages', type=int, default=backup.PAGES_PER_STEP)
+    parser.add_argument('--sleep', type=float, default=backup.STEP_SLEEP)
+    parser.add_argument('--baseline', type=float, default=5.0, help="seconds of order entry without a backup")
+    parser.add_argument('--interval', type=float, default=0.01, help="seconds between orders")
+    parser.add_argument('--workdir', help="directory for the benchmark database (default: a temp dir)")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='bench_backup_'))
+    # Absolute paths, so nothing here can touch the app's own database files
+    write_queue.DB_PATH = os.path.join(workdir, 'database', 'restaurant.db')
+    write_queue.QUEUE_PATH = os.path.join(workdir, 'database', 'write_queue.db')
+    backup_dir = os.path.join(workdir, 'database', 'backups')
+    try:
+        print(f"Building {args.size_mb} MB database in {workdir} ...")
+        build_database(workdir, args.size_mb)
+        write_queue.start_worker()
+
+        idle = run_writer(lambda: time.sleep(args.baseline), args.interval)
+
+        result = {}
+
+        def take_backup():
+            started = time.perf_counter()
+            result['path'] = backup.create_backup(write_queue.DB_PATH, backup_dir, args.pages, args.sleep)
+            result['elapsed'] = time.perf_counter() - started
+
+        during = run_writer(take_backup, args.interval)
+
+        print(f"Backup of {os.path.getsize(result['path']) / 2**20:.0f} MB took {result['elapsed']:.1f}s "
+              f"({args.pages} pages/step, {args.sleep * 1000:.0f}ms sleep)")
+        summarize("idle, acknowledged", idle[0])
+        summarize("idle, applied", idle[1])
+        summarize("backup, acknowledged", during[0])
+        summarize("backup, applied", during[1])
+    finally:
+        write_queue.stop_worker()
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import sqlite3
+import time
+
+import pytest
+
+import write_queue
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'restaurant.db')
+    monkeypatch.setattr(write_queue, 'DB_PATH', db_path)
+    monkeypatch.setattr(write_queue, 'QUEUE_PATH', str(tmp_path / 'write_queue.db'))
+    monkeypatch.setattr(write_queue, '_queue_ready', False)
+    monkeypatch.setattr(write_queue, 'LOCK_TIMEOUT', 0.05)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, table_id INTEGER, customer_name TEXT)")
+    conn.execute("CREATE TABLE order_items (id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL, menu_item_id INTEGER)")
+    conn.execute("CREATE TABLE bills (id INTEGER PRIMARY KEY, order_id INTEGER UNIQUE, amount REAL NOT NULL)")
+    conn.execute('''
+    CREATE TABLE applied_writes (
+        idem_key TEXT PRIMARY KEY,
+        row_id INTEGER,
+        error TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_replay_after_crash_does_not_insert_twice(db):
+    key = write_queue.enqueue([("INSERT INTO orders (table_id, customer_name) VALUES (?, ?)", (1, "Ada"))])
+    queue = sqlite3.connect(write_queue.QUEUE_PATH)
+    statements = queue.execute("SELECT statements FROM pending_writes WHERE idem_key = ?", (key,)).fetchone()[0]
+
+    assert write_queue.flush() == 1
+    # A crash before the pending_writes delete leaves the batch queued
+    queue.execute("INSERT INTO pending_writes (idem_key, statements) VALUES (?, ?)", (key, statements))
+    queue.commit()
+    queue.close()
+
+    assert write_queue.flush() == 1
+    assert count(db, 'orders') == 1
+    assert write_queue.pending_count() == 0
+    assert write_queue.resolve(key) == 1
+
+
+def test_ref_to_failed_write_fails_dependent_write(db):
+    bad = write_queue.enqueue([("INSERT INTO bills (order_id, amount) VALUES (?, NULL)", (1,))])
+    dependent = write_queue.enqueue([("INSERT INTO order_items (order_id, menu_item_id) VALUES (?, ?)",
+                                      (write_queue.ref(bad), 1))])
+    write_queue.flush()
+
+    with pytest.raises(write_queue.WriteFailed, match="NOT NULL"):
+        write_queue.resolve(bad)
+    with pytest.raises(write_queue.WriteFailed, match="depends on failed"):
+        write_queue.resolve(dependent)
+    assert count(db, 'order_items') == 0
+    assert write_queue.outcomes([bad, dependent]).keys() == {bad, dependent}
+
+
+def test_zero_row_insert_resolves_to_failure(db):
+    write_queue.enqueue([("INSERT INTO orders (table_id) VALUES (?)", (1,))])
+    empty = write_queue.enqueue([("INSERT INTO orders (table_id) SELECT table_id FROM orders WHERE 0", ())])
+    write_queue.flush()
+
+    with pytest.raises(write_queue.WriteFailed, match="inserted no row"):
+        write_queue.resolve(empty)
+
+
+def test_statement_changing_no_rows_rolls_back_whole_write(db):
+    order = write_queue.enqueue([("INSERT INTO orders (table_id) VALUES (?)", (1,))])
+    complete = write_queue.enqueue([
+        ("UPDATE orders SET customer_name = 'Done' WHERE id = ?", (write_queue.ref(order),)),
+        ("INSERT INTO bills (order_id, amount) SELECT ?, 1 WHERE 0", (write_queue.ref(order),), "Nothing to bill"),
+    ])
+    write_queue.flush()
+
+    assert write_queue.outcomes([complete]) == {complete: "Nothing to bill"}
+    assert db.execute("SELECT customer_name FROM orders").fetchone()[0] is None
+
+
+def test_lock_error_leaves_batch_queued(db):
+    key = write_queue.enqueue([("INSERT INTO orders (table_id) VALUES (?)", (1,))])
+    db.execute("BEGIN EXCLUSIVE")
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            write_queue.flush()
+    finally:
+        db.rollback()
+
+    assert write_queue.is_pending(key)
+    assert write_queue.flush() == 1
+    assert count(db, 'orders') == 1
+
+
+def test_wait_returns_at_once_while_busy(db, monkeypatch):
+    monkeypatch.setattr(write_queue, '_busy', True)
+    key = write_queue.enqueue([("INSERT INTO orders (table_id) VALUES (?)", (1,))])
+
+    started = time.monotonic()
+    assert write_queue.wait(key, timeout=5) is False
+    assert time.monotonic() - started < 1
@@ -0,0 +1,329 @@
+import sqlite3
+import json
+import logging
+import threading
+import time
+import uuid
+
+DB_PATH = 'database/restaurant.db'
+QUEUE_PATH = 'database/write_queue.db'
+
+# How many queued writes are applied in one transaction on the main database
+BATCH_SIZE = 50
+# Seconds the worker waits for a lock on the main database before retrying
+LOCK_TIMEOUT = 1.0
+# Seconds between retries while the main database is busy
+RETRY_DELAY = 0.5
+# Seconds the worker sleeps when nothing wakes it up
+FLUSH_INTERVAL = 2.0
+# Days an applied write's key is kept for replays and ref() lookups
+APPLIED_RETENTION_DAYS = 7
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_worker_lock = threading.Lock()
+_worker = None
+
+# Notified after every flush attempt; _busy is set while the main database
+# is locked and the worker is backing off
+_flushed = threading.Condition()
+_busy = False
+
+_queue_lock = threading.Lock()
+_queue_ready = False
+
+
+class WriteFailed(Exception):
+    pass
+
+
+# The queue lives in its own SQLite file so it stays writable while the
+# main database is locked by a backup or a long-running report. The schema
+# is created on first use in this process.
+def _connect_queue():
+    global _queue_ready
+    conn = sqlite3.connect(QUEUE_PATH, timeout=30)
+    if not _queue_ready:
+        with _queue_lock:
+            if not _queue_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute('''
+                CREATE TABLE IF NOT EXISTS pending_writes (
+                    id INTEGER PRIMARY KEY,
+                    idem_key TEXT NOT NULL UNIQUE,
+                    statements TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                ''')
+                conn.commit()
+                _queue_ready = True
+    return conn
+
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+# Values coming from pandas rows are numpy scalars, which json cannot encode
+def _to_json(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Cannot queue value of type {type(value).__name__}")
+
+
+# Queue one logical write made of (sql, params) statements. The write is
+# durable once this returns; the returned key identifies it from then on.
+# A parameter of the form ref(key) is replaced at apply time with the row id
+# inserted by that earlier write, e.g. order items of a queued order. A
+# statement may carry a third element, an error message: if that statement
+# changes no rows the whole write fails with it.
+def enqueue(statements, idem_key=None):
+    idem_key = idem_key or uuid.uuid4().hex
+    payload = json.dumps([[sql, list(params), *rest] for sql, params, *rest in statements], default=_to_json)
+    conn = _connect_queue()
+    try:
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("INSERT OR IGNORE INTO pending_writes (idem_key, statements) VALUES (?, ?)",
+                     (idem_key, payload))
+        conn.commit()
+    finally:
+        conn.close()
+    _wakeup.set()
+    return idem_key
+
+
+def ref(idem_key):
+    return {'ref': idem_key}
+
+
+# Writes are applied in queue order, so a referenced write has always been
+# applied (or has failed) by the time a write that refers to it comes up.
+# If it produced no row the dependent write fails too, rather than running
+# with NULL in place of the id.
+def _resolve_param(conn, param):
+    if isinstance(param, dict) and 'ref' in param:
+        row = conn.execute("SELECT row_id, error FROM applied_writes WHERE idem_key = ?",
+                           (param['ref'],)).fetchone()
+        if row is None:
+            raise WriteFailed(f"Write {param['ref']} it depends on was never applied")
+        if row[1] is not None:
+            raise WriteFailed(f"Write {param['ref']} it depends on failed: {row[1]}")
+        if row[0] is None:
+            raise WriteFailed(f"Write {param['ref']} it depends on inserted no row")
+        return row[0]
+    return param
+
+
+# Apply one queued write inside the batch transaction. Errors other than a
+# busy database are recorded against the write so one bad entry (e.g. a
+# duplicate bill) cannot block everything queued behind it.
+def _apply(conn, idem_key, statements):
+    if conn.execute("SELECT 1 FROM applied_writes WHERE idem_key = ?", (idem_key,)).fetchone():
+        return
+    conn.execute("SAVEPOINT queued_write")
+    try:
+        row_id = None
+        for sql, params, *expect in json.loads(statements):
+            c = conn.execute(sql, [_resolve_param(conn, p) for p in params])
+            if expect and c.rowcount == 0:
+                raise WriteFailed(expect[0])
+            # lastrowid is stale when an INSERT ... SELECT inserted nothing
+            if row_id is None and c.rowcount > 0 and sql.lstrip().upper().startswith('INSERT'):
+                row_id = c.lastrowid
+    except (sqlite3.Error, WriteFailed) as e:
+        if isinstance(e, sqlite3.OperationalError) and _is_lock_error(e):
+            raise
+        conn.execute("ROLLBACK TO queued_write")
+        conn.execute("RELEASE queued_write")
+        logger.warning("Queued write %s failed: %s", idem_key, e)
+        conn.execute("INSERT INTO applied_writes (idem_key, row_id, error) VALUES (?, NULL, ?)",
+                     (idem_key, str(e)))
+        return
+    conn.execute("RELEASE queued_write")
+    conn.execute("INSERT INTO applied_writes (idem_key, row_id) VALUES (?, ?)", (idem_key, row_id))
+
+
+# Drain up to batch_size queued writes into the main database in a single
+# transaction, dropping applied keys past their retention. Returns the
+# number of writes taken off the queue; raises sqlite3.OperationalError if
+# the main database stayed locked.
+def flush(batch_size=BATCH_SIZE):
+    queue = _connect_queue()
+    try:
+        rows = queue.execute("SELECT id, idem_key, statements FROM pending_writes ORDER BY id LIMIT ?",
+                             (batch_size,)).fetchall()
+        if not rows:
+            return 0
+
+        conn = sqlite3.connect(DB_PATH, timeout=LOCK_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for _, idem_key, statements in rows:
+                    _apply(conn, idem_key, statements)
+                conn.execute("DELETE FROM applied_writes WHERE applied_at < datetime('now', ?)",
+                             (f"-{APPLIED_RETENTION_DAYS} days",))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        # A crash before this delete only means the batch is replayed, and
+        # applied_writes makes the replay a no-op.
+        queue.executemany("DELETE FROM pending_writes WHERE id = ?", [(row[0],) for row in rows])
+        queue.commit()
+        return len(rows)
+    finally:
+        queue.close()
+
+
+def _set_busy(busy):
+    global _busy
+    with _flushed:
+        _busy = busy
+        _flushed.notify_all()
+
+
+def _run_worker():
+    while not _stop.is_set():
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        if _stop.is_set():
+            break
+        try:
+            while flush():
+                _set_busy(False)
+            _set_busy(False)
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e):
+                logger.exception("Write queue flush failed")
+            _set_busy(True)
+            time.sleep(RETRY_DELAY)
+            _wakeup.set()
+        except Exception:
+            logger.exception("Write queue flush failed")
+            _set_busy(True)
+            time.sleep(RETRY_DELAY)
+            _wakeup.set()
+
+
+# Start the background flush thread once per process. Streamlit reruns the
+# page script on every interaction, but imported modules are kept.
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name='write-queue', daemon=True)
+            _worker.start()
+    _wakeup.set()
+
+
+# Stop the background flush thread, e.g. before the database paths go away
+def stop_worker(timeout=None):
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _stop.set()
+            _wakeup.set()
+            _worker.join(timeout)
+            _worker = None
+            _stop.clear()
+
+
+def is_pending(idem_key):
+    conn = _connect_queue()
+    try:
+        return conn.execute("SELECT 1 FROM pending_writes WHERE idem_key = ?", (idem_key,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+# Whether any queued write still refers to idem_key through ref()
+def has_pending_refs(idem_key):
+    conn = _connect_queue()
+    try:
+        return conn.execute("SELECT 1 FROM pending_writes WHERE instr(statements, ?) > 0",
+                            (json.dumps(ref(idem_key)),)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def pending_count():
+    conn = _connect_queue()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Drop every queued write without applying it and return how many there were
+def discard_pending():
+    conn = _connect_queue()
+    try:
+        discarded = conn.execute("DELETE FROM pending_writes").rowcount
+        conn.commit()
+        return discarded
+    finally:
+        conn.close()
+
+
+# Give the worker a short, bounded chance to apply a write so the next page
+# render usually shows it. Returns False at once while the worker is backing
+# off from a locked database, so submits never stall on a busy database.
+def wait(idem_key, timeout=0.25):
+    deadline = time.monotonic() + timeout
+    with _flushed:
+        while is_pending(idem_key):
+            remaining = deadline - time.monotonic()
+            if _busy or remaining <= 0:
+                return False
+            _wakeup.set()
+            _flushed.wait(remaining)
+    return True
+
+
+# Row id inserted by an applied write, or None while it is still queued (or
+# if the main database cannot be read right now). Raises WriteFailed if the
+# write failed, inserted no row, or is neither queued nor recorded as applied.
+def resolve(idem_key):
+    if is_pending(idem_key):
+        return None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=LOCK_TIMEOUT)
+        try:
+            row = conn.execute("SELECT row_id, error FROM applied_writes WHERE idem_key = ?",
+                               (idem_key,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return None
+    if row is None:
+        raise WriteFailed(f"Write {idem_key} was never applied")
+    if row[1] is not None:
+        raise WriteFailed(row[1])
+    if row[0] is None:
+        raise WriteFailed(f"Write {idem_key} inserted no row")
+    return row[0]
+
+
+# Outcome of each of idem_keys that has been applied: None if it succeeded,
+# otherwise its error. Keys still queued, or all of them if the main
+# database cannot be read right now, are left out.
+def outcomes(idem_keys):
+    if not idem_keys:
+        return {}
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=LOCK_TIMEOUT)
+        try:
+            rows = conn.execute(f"SELECT idem_key, error FROM applied_writes WHERE idem_key IN "
+                                f"({', '.join('?' * len(idem_keys))})", list(idem_keys)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return {}
+    return dict(rows)